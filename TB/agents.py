@@ -6,6 +6,8 @@ from mesa import Agent
 from mesa.space import accept_tuple_argument
 from numpy.lib.twodim_base import triu_indices_from
 
+from TB.eventlog import INFECTION, CHRONIC, ACTIVATION, BURST, T_KILL, NECROSIS, RECRUIT_MP, RECRUIT_T
+
 def accept_tuple_argument(wrapped_function):
     """Decorator to allow grid methods that take a list of (x, y) coord tuples
     to also handle a single position, by automatically wrapping tuple in
@@ -26,6 +28,54 @@ def sigmond(x):
     return 1 / (1 + np.exp(-x))
 
 
+def diffuse(C, C1, diffC):
+    # Explicit diffusion step; the border of C1 stays at zero
+    C1[1:-1, 1:-1] = C[1:-1, 1:-1] + diffC * (
+    (C[2:, 1:-1] - 2*C[1:-1, 1:-1] + C[:-2, 1:-1])
+      + (C[1:-1, 2:] - 2*C[1:-1, 1:-1] + C[1:-1, :-2]))
+
+    return C1.copy()
+
+
+def diffuse_coarse(C, diffC, factor):
+    """
+    Explicit diffusion step on a grid coarsened by factor, with the zero
+    boundary at the centre of the fine border cells, as at full resolution.
+    Ghost cells outside the coarse grid hold the linear extrapolation that
+    vanishes there.
+    """
+    ghost = -(factor + 1) / (factor - 1)
+    P = np.pad(C, 1)
+    P[0, 1:-1] = ghost * C[0]
+    P[-1, 1:-1] = ghost * C[-1]
+    P[1:-1, 0] = ghost * C[:, 0]
+    P[1:-1, -1] = ghost * C[:, -1]
+    return C + diffC * (P[2:, 1:-1] + P[:-2, 1:-1] + P[1:-1, 2:] + P[1:-1, :-2] - 4*C)
+
+
+def prolongation(n, factor):
+    """
+    (n, n / factor) matrix interpolating a coarse axis linearly between
+    coarse cell centres back to n fine cells; beyond the outer centres it
+    falls linearly to zero at the fine border cells
+    """
+    nc = n // factor
+    P = np.zeros((n, nc))
+    u = (np.arange(n) + 0.5) / factor - 0.5
+    edge = 0.5 - 0.5 / factor
+    inner = np.clip(u, 0, nc - 1)
+    i0 = np.floor(inner).astype(int)
+    i1 = np.minimum(i0 + 1, nc - 1)
+    w = inner - i0
+    # Linear fall-off towards the zero boundary outside the outer centres
+    scale = np.ones(n)
+    if edge > 0:
+        scale = np.clip(1 - np.maximum(-u, u - (nc - 1)) / edge, 0, 1)
+    P[np.arange(n), i0] += (1 - w) * scale
+    P[np.arange(n), i1] += w * scale
+    return P
+
+
 class DirectedRandomWalker(Agent):
     """
     Class implementing random walker methods in a generalized manner.
@@ -73,8 +123,7 @@ class DirectedRandomWalker(Agent):
             p = c_sigmond / np.sum(c_sigmond)
         else:
             p = np.ones(pos_cnt) / pos_cnt
-        pre_index = np.array([0, 1, 2, 3, 4, 5, 6, 7])
-        index = np.random.choice(pre_index[:pos_cnt], p = p)
+        index = self.model.stream("move").choices(range(pos_cnt), weights = p)[0]
 
         return next_moves[index]
     
@@ -113,6 +162,10 @@ class Env(Agent):
         BE: No. of extracellular bacteria
         death_cnt: No. of chronically infected macrophage die in the grid
         Necrosis: the status of the grid, cells cannot excess necrotic places
+        coarsen: downsampling factor of the grid chemokine is solved on;
+                 C is interpolated back from the coarse field Cc every tick
+        C_error: relative L2 error of C against the full-resolution field,
+                 one value per tick when the model checks the chemokine
         """
         super().__init__(unique_id, model)
         self.height = self.model.height
@@ -125,26 +178,67 @@ class Env(Agent):
         self.start_time = 1
         self.time = 1
         self.oneStep = 1
-    
+
+        self.coarsen = self.model.coarsen
+        if isinstance(self.coarsen, bool) or not isinstance(self.coarsen, (int, np.integer)) or self.coarsen < 1:
+            raise ValueError("coarsen must be a positive integer, got %r" % (self.coarsen,))
+        if self.coarsen > 1:
+            if self.height % self.coarsen or self.width % self.coarsen:
+                raise ValueError("Grid size must be a multiple of coarsen")
+            self.Cc = np.zeros((self.height // self.coarsen, self.width // self.coarsen))
+            self.Px = prolongation(self.height, self.coarsen)
+            self.Py = prolongation(self.width, self.coarsen)
+        if self.model.check_chemokine:
+            self.C_ref = self.C.copy()
+            self.C_ref1 = self.C.copy()
+            self.C_error = []
+
     def step(self):
         for cnt in range(round(self.model.k)):
             # Decay and Diffusion of chemokine
-            self.C = (1 - self.model.decayC) * self.C
-            self.Diffusion()
+            if self.coarsen > 1:
+                self.Cc = (1 - self.model.decayC) * self.Cc
+                self.Cc = diffuse_coarse(self.Cc, self.model.diffC / self.coarsen ** 2, self.coarsen)
+            else:
+                self.C = (1 - self.model.decayC) * self.C
+                self.Diffusion()
+            if self.model.check_chemokine:
+                self.C_ref = (1 - self.model.decayC) * self.C_ref
+                self.C_ref = diffuse(self.C_ref, self.C_ref1, self.model.diffC)
             
             # Replication of bacteria
             self.BE = self.BE + self.model.alpha_BE * self.BE * (1 - (self.BE / self.model.K_BE))
 
             # Necrosis
             self.necrosis = self.death_cnt >= self.model.N_necr
+
+        if self.coarsen > 1:
+            self.C = self.Px @ self.Cc @ self.Py.T
+            # Zero border, as left by the full-resolution diffusion
+            self.C[[0, -1], :] = 0.0
+            self.C[:, [0, -1]] = 0.0
+        if self.model.check_chemokine:
+            norm = np.linalg.norm(self.C_ref)
+            self.C_error.append(np.linalg.norm(self.C - self.C_ref) / norm if norm > 0 else 0.0)
     
     def Diffusion(self):
         # Diffusion function
-        self.C1[1:-1, 1:-1] = self.C[1:-1, 1:-1] + self.model.diffC * (
-        (self.C[2:, 1:-1] - 2*self.C[1:-1, 1:-1] + self.C[:-2, 1:-1])
-          + (self.C[1:-1, 2:] - 2*self.C[1:-1, 1:-1] + self.C[1:-1, :-2]))
-        
-        self.C = self.C1.copy()
+        self.C = diffuse(self.C, self.C1, self.model.diffC)
+
+    def secrete(self, pos, amount):
+        """
+        Release chemokine at pos; on the coarse grid the deposit is spread
+        over the coarse cell containing pos, conserving its amount. Deposits
+        on the border cells are lost at the next diffusion step, as at full
+        resolution.
+        """
+        x, y = pos
+        self.C[x, y] += amount
+        on_border = x in (0, self.C.shape[0] - 1) or y in (0, self.C.shape[1] - 1)
+        if self.coarsen > 1 and not on_border:
+            self.Cc[x // self.coarsen, y // self.coarsen] += amount / self.coarsen ** 2
+        if self.model.check_chemokine:
+            self.C_ref[x, y] += amount
 
     
     def timeAdd(self):
@@ -172,7 +266,7 @@ class T(DirectedRandomWalker):
         """
         super().__init__(unique_id, pos, model, moore = moore)
         self.pos = pos
-        self.age = random.randint(0, self.model.T_ls)
+        self.age = self.model.randint("T_age", 0, self.model.T_ls)
 
         self.start_time = 1
         self.time = 1
@@ -186,7 +280,7 @@ class T(DirectedRandomWalker):
         """
         next_move = self.directed_random_move()
         if len(self.get_cell_list_contents([next_move], T)) == 0 and self.model.env.necrosis[next_move] == False:
-            if (len(self.get_cell_list_contents([next_move], MP)) == 0) or (random.random() < self.model.T_move):
+            if (len(self.get_cell_list_contents([next_move], MP)) == 0) or (self.model.stream("T_move").random() < self.model.T_move):
                 self.model.grid.move_agent(self, next_move)
         
         # Aging
@@ -217,7 +311,7 @@ class MP(DirectedRandomWalker):
         self.oneStep = 100 / self.model.k
     
     def ChemokineSecretion(self):
-        self.model.env.C[self.pos[0], self.pos[1]] += self.model.c_I
+        self.model.env.secrete(self.pos, self.model.c_I)
     
     def MPWalk(self):
         """
@@ -241,7 +335,7 @@ class RestMP(MP):
         """        
         super().__init__(unique_id, pos, model, moore = moore)
         self.pos = pos
-        self.age = random.randint(0, self.model.M_rls)
+        self.age = self.model.randint("MP_age", 0, self.model.M_rls)
         self.exist = True
 
         self.start_time = 1
@@ -261,7 +355,7 @@ class RestMP(MP):
         if (self.model.env.BE[self.pos] <= self.model.N_RK):
             self.model.env.BE[self.pos] = 0
         else:
-            if (random.random() < self.model.p_k):
+            if (self.model.stream("infection").random() < self.model.p_k):
                 self.model.env.BE[self.pos] -= self.model.N_RK
             else:
                 self.model.grid._remove_agent(self.pos, self)
@@ -271,6 +365,7 @@ class RestMP(MP):
                 inMP = InfectMP(self.model.next_id(), self.pos, self.model, self.moore, self.age, self.model.N_RK)
                 self.model.grid.place_agent(inMP, self.pos)
                 self.model.schedule.add(inMP)
+                self.model.log_event(INFECTION, self.pos, inMP.unique_id, inMP.B_I)
         
         # Aging & Die
         if self.exist:
@@ -322,18 +417,20 @@ class InfectMP(MP):
             chinMP = ChronInfectMP(self.model.next_id(), self.pos, self.model, self.moore, self.B_I)
             self.model.grid.place_agent(chinMP, self.pos)
             self.model.schedule.add(chinMP)
+            self.model.log_event(CHRONIC, self.pos, chinMP.unique_id, self.B_I)
 
         #Become activated by T cells
         if self.exist:
             ngh = self.model.grid.get_neighbors(self.pos, moore = False, include_center = True)
             ngh_T = [obj for obj in ngh if isinstance(obj, T)]
-            if (random.random() < len(ngh_T) * self.model.T_actm):
+            if (self.model.stream("activation").random() < len(ngh_T) * self.model.T_actm):
                 self.model.grid._remove_agent(self.pos, self)
                 self.model.schedule.remove(self)
                 self.exist = False
                 actMP = ActivatedMP(self.model.next_id(), self.pos, self.model, self.moore)
                 self.model.grid.place_agent(actMP, self.pos)
                 self.model.schedule.add(actMP)
+                self.model.log_event(ACTIVATION, self.pos, actMP.unique_id, self.B_I)
 
         #Aging & Die, then release intracellular bacteria
         if self.exist:
@@ -358,7 +455,7 @@ class ChronInfectMP(MP):
         """        
         super().__init__(unique_id, pos, model, moore = moore)
         self.B_I = B_I
-        self.age = random.randint(0, self.model.M_rls)
+        self.age = self.model.randint("MP_age", 0, self.model.M_rls)
         self.exist = True
 
         self.start_time = 1
@@ -383,12 +480,13 @@ class ChronInfectMP(MP):
 
         #T cell killing
         cell_T = self.get_cell_list_contents([self.pos], T)
-        if (len(cell_T) > 0 and random.random() < self.model.pT_k):
+        if (len(cell_T) > 0 and self.model.stream("T_kill").random() < self.model.pT_k):
             self.model.env.BE[x-1:x+2, y-1:y+2] += 0.5 * self.B_I / 9
             self.model.grid._remove_agent(self.pos, self)
             self.model.schedule.remove(self)
             self.exist = False
             self.model.env.death_cnt[x, y] += 1.0
+            self.model.log_event(T_KILL, self.pos, self.unique_id, self.B_I)
 
         # Aging & Bursting
         if self.exist:
@@ -399,11 +497,13 @@ class ChronInfectMP(MP):
                 self.model.schedule.remove(self)
                 self.exist = False
                 self.model.env.death_cnt[x, y] += 1.0
+                self.model.log_event(BURST, self.pos, self.unique_id, self.B_I)
         
         if self.model.env.death_cnt[x, y] >= self.model.N_necr and self.model.env.necrosis[x, y] == False:
             self.model.env.necrosis[x, y] = True
             necrosis = Necrosis(self.model.next_id(), self.pos, self.model)
             self.model.grid.place_agent(necrosis, self.pos)
+            self.model.log_event(NECROSIS, self.pos, necrosis.unique_id)
 
         
 class ActivatedMP(MP):
@@ -416,7 +516,7 @@ class ActivatedMP(MP):
         age: age of the macrophage, ranging from 0 to activated macrophage lifespan
         """        
         super().__init__(unique_id, pos, model, moore = moore)
-        self.age = random.randint(0, self.model.M_als)
+        self.age = self.model.randint("MP_age", 0, self.model.M_als)
         
         self.start_time = 1
         self.time = 1
@@ -466,10 +566,10 @@ class Source(Agent):
         this_cell = self.model.grid.get_cell_list_contents([self.pos])
         place_MP = False
         place_T = False
-        if (random.random() < self.model.M_recr):
+        if (self.model.stream("recruit_MP").random() < self.model.M_recr):
             place_MP = True
         # Recruit T cells after self.model.t_T ticks
-        if ((random.random() < self.model.T_recr) and (self.model.schedule.time > self.model.t_T / self.model.k)):
+        if ((self.model.stream("recruit_T").random() < self.model.T_recr) and (self.model.schedule.time > self.model.t_T / self.model.k)):
             place_T = True
         if (place_T or place_MP):
             for obj in this_cell:
@@ -484,10 +584,12 @@ class Source(Agent):
             newMP = RestMP(self.model.next_id(), self.pos, self.model, moore = True)
             self.model.grid.place_agent(newMP, newMP.pos)
             self.model.schedule.add(newMP)
+            self.model.log_event(RECRUIT_MP, self.pos, newMP.unique_id)
         if place_T:
             newT = T(self.model.next_id(), self.pos, self.model, moore = True)
             self.model.grid.place_agent(newT, newT.pos)
             self.model.schedule.add(newT)
+            self.model.log_event(RECRUIT_T, self.pos, newT.unique_id)
         
 
     def timeAdd(self):
@@ -0,0 +1,125 @@
+"""
+Stepping a model continuously on a background thread
+
+The interactive server uses BackgroundRunner so that the simulation
+advances at full speed while the browser samples the latest state at its
+own frame rate. Every tick runs under `lock`; anything reading or changing
+the model from another thread takes the lock and so sees it between ticks.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from TB.agents import InfectMP, ChronInfectMP
+
+
+class BackgroundRunner:
+
+    def __init__(self, model, idle_timeout = None):
+        """
+        model: the model to step; its print-monitoring is turned off
+        idle_timeout: seconds without touch after which continuous
+                      stepping pauses (None: never)
+        """
+        self.model = model
+        self.idle_timeout = idle_timeout
+        self.last_touch = time.time()
+        self.model.verbose = False
+        self.lock = threading.Lock()
+        self.target = None
+        self.running = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.stopped = False
+        self.thread = threading.Thread(target = self.loop, daemon = True)
+        self.thread.start()
+
+    def finished(self):
+        model = self.model
+        if model.schedule.steps >= model.total_ticks():
+            return True
+        return (
+            np.sum(model.env.BE) == 0.0
+            and model.schedule.get_breed_count(InfectMP) == 0
+            and model.schedule.get_breed_count(ChronInfectMP) == 0
+        )
+
+    def loop(self):
+        while True:
+            self.running.wait()
+            if self.stopped:
+                return
+            with self.lock:
+                if not self.running.is_set():
+                    # Paused while waiting for the lock
+                    continue
+                if self.target is None and self.idle_timeout is not None and time.time() - self.last_touch > self.idle_timeout:
+                    # Nobody is watching any more
+                    self.running.clear()
+                    self.idle.set()
+                    continue
+                if self.target is None or self.model.schedule.steps < self.target:
+                    self.model.step()
+                if self.finished():
+                    self.model.running = False
+                    self.model.close()
+                if not self.model.running or self.model.schedule.steps == self.target:
+                    self.running.clear()
+                    self.idle.set()
+
+    def touch(self):
+        """
+        Keep continuous stepping alive for another idle_timeout
+        """
+        self.last_touch = time.time()
+
+    def resume(self):
+        """
+        Step continuously
+        """
+        with self.lock:
+            self.target = None
+        self.touch()
+        self.start()
+
+    def run_ticks(self, n, wait = False):
+        """
+        Step n more ticks, then pause; idle is set once they are done
+
+        Args:
+            wait: block the caller until the n ticks are done
+        """
+        with self.lock:
+            self.target = self.model.schedule.steps + n
+        self.start()
+        if wait:
+            self.idle.wait()
+
+    def start(self):
+        if self.model.running:
+            self.idle.clear()
+            self.running.set()
+
+    def pause(self):
+        with self.lock:
+            self.running.clear()
+            self.idle.set()
+
+    def stop(self):
+        """
+        End the thread and close the model's event log
+        """
+        self.stopped = True
+        self.running.set()
+        self.thread.join()
+        self.model.close()
+
+    def set_params(self, **params):
+        """
+        Change model parameters between two ticks
+        """
+        with self.lock:
+            for name, value in params.items():
+                setattr(self.model, name, value)
@@ -0,0 +1,115 @@
+"""
+Branching runs from a shared warmed-up model state
+
+warm_up runs one model up to a chosen tick (e.g. t_T, when T cells start to
+arrive). branch then forks one child process per branch: every child
+shares the warmed-up state copy-on-write, reseeds its random streams,
+applies its parameter overrides and continues the run. The common prefix
+is simulated once instead of once per branch.
+
+    model = warm_up(seed = 0, steps = 1440)
+    runs = branch(model, [
+        {"seed": 1, "params": {"T_recr": 0.2}},
+        {"seed": 2, "params": {"T_recr": 0.4, "T_actm": 0.05}},
+    ], steps = 1440)
+
+Only parameters read while stepping can be overridden (T_recr, T_move,
+T_actm, pT_k, p_k, M_recr...); those used when the model is created, such
+as k or the grid size, are already baked into the warmed-up state.
+Requires the fork start method (Linux, macOS).
+
+Branches of a model with an event log write one log each: the event_log
+path must hold {branch}, replaced by the index of the branch ("warmup"
+for the common prefix), and may hold {seed}.
+"""
+
+import multiprocessing
+
+from TB.eventlog import EventLog, log_path, require_placeholder
+from TB.model import TB
+from TB.runner import outcomes
+
+# Model shared with the forked children
+_warm_model = None
+
+
+def warm_up(params = None, seed = None, steps = None, model_cls = TB):
+    """
+    Run the common prefix of the branches
+
+    Args:
+        steps: No. of ticks of the prefix (None: up to the T-cell arrival t_T)
+    """
+    params = dict(params or {})
+    model_params = dict(params)
+    if params.get("event_log") is not None:
+        model_params["event_log"] = log_path(params["event_log"], branch = "warmup")
+    model = model_cls(seed = seed, **model_params)
+    model.verbose = False
+    model.warm_params = params
+    if steps is None:
+        steps = round(model.t_T / model.k)
+    model.run_model(steps)
+    return model
+
+
+def run_branch(branch, steps):
+    model = _warm_model
+    overrides = dict(branch.get("params", {}))
+    for name, value in overrides.items():
+        if not hasattr(model, name):
+            raise ValueError("Unknown model parameter: %s" % name)
+        setattr(model, name, value)
+    model.reseed(branch["seed"])
+    if model.events is not None:
+        # Do not write to the parent's log through the inherited handle
+        model.events.detach()
+        model.events = EventLog(log_path(branch["event_log"], seed = branch["seed"], branch = branch["index"]), model.events.shape)
+    model.run_model(steps)
+    model.close()
+    params = dict(getattr(model, "warm_params", {}), **overrides)
+    result = outcomes(model, params, branch["seed"])
+    result["branch_step"] = branch["branch_step"]
+    return result
+
+
+def branch(model, branches, steps = None, processes = None):
+    """
+    Continue a warmed-up model in one forked child process per branch
+
+    Args:
+        model: the warmed-up model, left untouched
+        branches: list of dicts with the "seed" of the branch and its
+                  "params" overrides
+        steps: No. of ticks each branch runs on (None: up to the end of a
+               full run, the model's total_ticks())
+        processes: No. of branches running at once (None: No. of CPUs)
+
+    Returns:
+        list of outcome dicts (see TB.runner), in the order of branches;
+        their "params" are the warm-up params updated with the branch
+        overrides, "branch_step" is the tick the branches started from
+    """
+    global _warm_model
+    if steps is None:
+        steps = model.total_ticks() - model.schedule.steps
+    template = getattr(model, "warm_params", {}).get("event_log", model.event_log)
+    if model.events is not None:
+        require_placeholder(template, "branch", 2)
+        # Write out the warm-up records before the children inherit them
+        if not model.events.file.closed:
+            model.events.flush()
+    tasks = [
+        (dict(b, branch_step = model.schedule.steps, index = i, event_log = template), steps)
+        for i, b in enumerate(branches)
+    ]
+
+    _warm_model = model
+    try:
+        # One fresh fork of this process per branch, so that every branch
+        # starts from the pristine warmed-up state
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(processes, maxtasksperchild = 1) as pool:
+            return pool.starmap(run_branch, tasks, chunksize = 1)
+    finally:
+        _warm_model = None
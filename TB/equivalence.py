@@ -0,0 +1,145 @@
+"""
+Statistical equivalence of an alternative engine against the reference TB model
+
+Faster engines consume random numbers in a different order, so their runs
+cannot be compared bit-for-bit with TB. Instead both engines are run over
+many seeds and the distributions of their outcomes are compared with
+two-sample Kolmogorov-Smirnov tests. The candidate runs on seeds disjoint
+from the reference ones, so that engines sharing part of TB's random
+streams still give independent samples.
+
+Passing means that no difference was detected, not that the engines are
+proven equal: with some 60 Bonferroni-corrected tests on discrete counts
+and 50 seeds per engine, only large shifts of a distribution fail. Use
+more seeds to detect smaller ones.
+"""
+
+import numpy as np
+
+from TB.model import TB
+from TB.runner import run_replicates
+
+# Offset of the default candidate seeds from the reference seeds
+SEED_OFFSET = 10**6
+
+
+def ks_2samp(a, b):
+    """
+    Two-sample Kolmogorov-Smirnov test
+
+    Returns:
+        tuple of (statistic, p-value); the p-value uses the asymptotic
+        Kolmogorov distribution with the Stephens small-sample correction
+    """
+    a = np.sort(np.asarray(a, dtype = float))
+    b = np.sort(np.asarray(b, dtype = float))
+    n, m = len(a), len(b)
+    data = np.concatenate([a, b])
+    cdf_a = np.searchsorted(a, data, side = "right") / n
+    cdf_b = np.searchsorted(b, data, side = "right") / m
+    d = float(np.max(np.abs(cdf_a - cdf_b)))
+
+    en = np.sqrt(n * m / (n + m))
+    lam = (en + 0.12 + 0.11 / en) * d
+    if lam < 0.2:
+        return d, 1.0
+    j = np.arange(1, 101)
+    p = 2 * np.sum((-1) ** (j - 1) * np.exp(-2 * j ** 2 * lam ** 2))
+    return d, float(np.clip(p, 0.0, 1.0))
+
+
+def series_matrix(runs, name, length):
+    """
+    Stack one DataCollector series of every run into a (runs, length) array.
+    Runs that stopped early are padded with their last value.
+    """
+    out = np.empty((len(runs), length))
+    for i, run in enumerate(runs):
+        values = np.asarray(run["series"][name][:length], dtype = float)
+        out[i, :len(values)] = values
+        out[i, len(values):] = values[-1]
+    return out
+
+
+def compare(reference_runs, candidate_runs, alpha = 0.05, checkpoints = 10):
+    """
+    Compare the outcome distributions of two sets of runs.
+
+    Args:
+        reference_runs, candidate_runs: lists of outcome dicts (TB.runner)
+        alpha: family-wise significance level, Bonferroni-corrected over
+               all tests
+        checkpoints: No. of evenly spaced ticks at which each breed series
+                     is compared
+
+    Returns:
+        dict with "passed" (no test detected a difference) and "tests", a
+        list of dicts with the name, statistic and p-value of every test
+    """
+    tests = []
+    for key in ("bacterial_load", "necrosis_area"):
+        d, p = ks_2samp(
+            [run[key] for run in reference_runs],
+            [run[key] for run in candidate_runs],
+        )
+        tests.append({"name": key, "statistic": d, "pvalue": p})
+
+    length = max(len(values) for run in reference_runs + candidate_runs for values in run["series"].values())
+    ticks = np.unique(np.linspace(0, length - 1, checkpoints).astype(int))
+    for name in reference_runs[0]["series"]:
+        ref = series_matrix(reference_runs, name, length)
+        cand = series_matrix(candidate_runs, name, length)
+        for tick in ticks:
+            d, p = ks_2samp(ref[:, tick], cand[:, tick])
+            tests.append({"name": "%s@%d" % (name, tick), "statistic": d, "pvalue": p})
+
+    threshold = alpha / len(tests)
+    for test in tests:
+        test["passed"] = test["pvalue"] >= threshold
+    return {
+        "passed": all(test["passed"] for test in tests),
+        "alpha": alpha,
+        "threshold": threshold,
+        "tests": tests,
+    }
+
+
+def validate(candidate_cls, reference_cls = TB, params = None, seeds = range(50), steps = None, processes = None, candidate_seeds = None, **kwargs):
+    """
+    Run the reference and candidate engines in parallel and compare their
+    outcome distributions (see compare).
+
+    Args:
+        seeds: seeds of the reference runs
+        candidate_seeds: seeds of the candidate runs, disjoint from seeds
+                         (None: seeds shifted by SEED_OFFSET)
+    """
+    seeds = list(seeds)
+    if candidate_seeds is None:
+        candidate_seeds = [seed + SEED_OFFSET for seed in seeds]
+    candidate_seeds = list(candidate_seeds)
+    if set(seeds) & set(candidate_seeds):
+        raise ValueError("Reference and candidate seeds must be disjoint")
+    reference_runs = run_replicates(params, seeds, steps, reference_cls, processes)
+    candidate_runs = run_replicates(params, candidate_seeds, steps, candidate_cls, processes)
+    return compare(reference_runs, candidate_runs, **kwargs)
+
+
+def format_report(result):
+    """
+    Render the result of compare as a plain-text pass/fail report
+    """
+    lines = ["%-24s %10s %10s  %s" % ("test", "statistic", "p-value", "result")]
+    for test in result["tests"]:
+        lines.append(
+            "%-24s %10.4f %10.4f  %s"
+            % (test["name"], test["statistic"], test["pvalue"], "pass" if test["passed"] else "FAIL")
+        )
+    lines.append(
+        "%s (alpha = %g, Bonferroni threshold = %.2e)"
+        % (
+            "PASSED: no difference detected" if result["passed"] else "FAILED: outcome distributions differ",
+            result["alpha"], result["threshold"],
+        )
+    )
+    return "\n".join(lines)
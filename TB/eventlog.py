@@ -0,0 +1,188 @@
+"""
+Compact binary log of cell state transitions
+
+Every event is one fixed-width little-endian record
+(tick, event, x, y, agent_id, B_I), 17 bytes, buffered in chunks and
+appended to the log file after a 12-byte header (magic, grid shape).
+read_events loads a log as a numpy structured array, so transition rates
+and spatial event maps are plain vectorized reductions. Records reach the
+file when a chunk is full and when the log is flushed or closed (TB.close,
+or the end of run_model), so runs driven by TB.step should end with
+TB.close; a closed log refuses further records.
+
+    events = read_events(path)
+    infections = event_map(events, "infection", read_shape(path))
+
+Runs in several processes must not share a log file. The log path of a
+model may hold placeholders filled per run: {seed} (TB, TB.runner),
+{branch} (TB.branching) and {id} (task id of TB.workqueue).
+
+agent_id is the agent the event creates (infected, chronically infected
+or activated macrophage, necrosis, recruited cell), or the dying
+macrophage for bursts and T-cell killing.
+"""
+
+import numpy as np
+
+MAGIC = b"TBEVLOG2"
+
+# Grid shape (x, y) following the magic
+SHAPE_DTYPE = np.dtype("<u2")
+HEADER_SIZE = len(MAGIC) + 2 * SHAPE_DTYPE.itemsize
+
+EVENT_DTYPE = np.dtype([
+    ("tick", "<u4"),
+    ("event", "u1"),
+    ("x", "<u2"),
+    ("y", "<u2"),
+    ("agent_id", "<u4"),
+    ("B_I", "<f4"),
+])
+
+INFECTION = 1       # RestMP -> InfectMP
+CHRONIC = 2         # InfectMP -> ChronInfectMP
+ACTIVATION = 3      # InfectMP -> ActivatedMP
+BURST = 4           # ChronInfectMP bursts or dies of age
+T_KILL = 5          # ChronInfectMP killed by a T cell
+NECROSIS = 6        # Necrosis created
+RECRUIT_MP = 7      # Source recruits a RestMP
+RECRUIT_T = 8       # Source recruits a T cell
+
+EVENTS = {
+    "infection": INFECTION,
+    "chronic": CHRONIC,
+    "activation": ACTIVATION,
+    "burst": BURST,
+    "T_kill": T_KILL,
+    "necrosis": NECROSIS,
+    "recruit_MP": RECRUIT_MP,
+    "recruit_T": RECRUIT_T,
+}
+
+
+def log_path(template, **fields):
+    """
+    Fill the given placeholders ({seed}, {branch}, {id}) of a log path
+    """
+    for name, value in fields.items():
+        template = template.replace("{%s}" % name, str(value))
+    return template
+
+
+def require_placeholder(template, name, runs):
+    """
+    Refuse a log path shared by several runs: it must hold {name}
+    """
+    if template is not None and runs > 1 and "{%s}" % name not in template:
+        raise ValueError("event_log is shared by %d runs; put {%s} in its path" % (runs, name))
+
+
+class EventLog:
+    """
+    Writer of an event log
+    """
+
+    def __init__(self, path, shape, chunk = 65536):
+        """
+        path: log file, truncated
+        shape: (x, y) size of the grid the events happen on
+        chunk: No. of records buffered before they are written
+        """
+        self.path = path
+        self.shape = tuple(shape)
+        self.buffer = np.empty(chunk, dtype = EVENT_DTYPE)
+        self.n = 0
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.file.write(np.array(self.shape, dtype = SHAPE_DTYPE).tobytes())
+        self.file.flush()
+
+    def record(self, tick, event, pos, agent_id, B_I = 0.0):
+        if self.file.closed:
+            raise ValueError("Event log already closed: %s" % self.path)
+        self.buffer[self.n] = (tick, event, pos[0], pos[1], agent_id, B_I)
+        self.n += 1
+        if self.n == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer[:self.n].tobytes())
+        self.file.flush()
+        self.n = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def detach(self):
+        """
+        Drop the file handle without writing anything, e.g. the handle of
+        the parent's log inherited by a forked child
+        """
+        self.n = 0
+        self.file.close()
+
+    def __del__(self):
+        # Last resort for logs of runs that were never closed
+        if hasattr(self, "file"):
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_shape(path):
+    """
+    Grid shape (x, y) stored in the header of an event log
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a TB event log: %s" % path)
+    return tuple(int(n) for n in np.frombuffer(header[len(MAGIC):], dtype = SHAPE_DTYPE))
+
+
+def read_events(path, mmap = False):
+    """
+    Load an event log as a structured array with the fields of EVENT_DTYPE
+
+    Args:
+        mmap: memory-map the file instead of reading it
+    """
+    read_shape(path)
+    if mmap:
+        return np.memmap(path, dtype = EVENT_DTYPE, mode = "r", offset = HEADER_SIZE)
+    return np.fromfile(path, dtype = EVENT_DTYPE, offset = HEADER_SIZE)
+
+
+def event_counts(events, bin = 1, n_bins = None):
+    """
+    No. of events of every type per bin of `bin` ticks
+
+    Returns:
+        dict of event name -> array of counts
+    """
+    bins = events["tick"] // bin
+    if n_bins is None:
+        n_bins = int(bins.max()) + 1 if len(events) else 0
+    return {
+        name: np.bincount(bins[events["event"] == code], minlength = n_bins)[:n_bins]
+        for name, code in EVENTS.items()
+    }
+
+
+def event_map(events, event, shape):
+    """
+    Spatial map of the No. of events of one type (name or code) per grid cell
+
+    Args:
+        shape: (x, y) size of the grid, see read_shape
+    """
+    code = EVENTS.get(event, event)
+    selected = events[events["event"] == code]
+    flat = selected["x"].astype(np.int64) * shape[1] + selected["y"]
+    return np.bincount(flat, minlength = shape[0] * shape[1]).reshape(shape)
@@ -0,0 +1,147 @@
+"""
+In-simulation spatial metrics of granuloma structure
+
+Every registered metric is a cheap vectorized reducer over the Env arrays
+and the grid occupancy. When a model is created with metrics_every > 0 the
+metrics are evaluated every metrics_every ticks and stored as rows of the
+"Spatial" table of the model's DataCollector.
+"""
+
+import numpy as np
+
+from TB.agents import T, RestMP, InfectMP, ChronInfectMP, ActivatedMP
+
+SPATIAL_METRICS = {}
+
+
+def register_metric(name):
+    """
+    Decorator adding a metric to the registry.
+    The metric is called with the dict of fields built by spatial_fields.
+    """
+    def wrapper(fn):
+        SPATIAL_METRICS[name] = fn
+        return fn
+
+    return wrapper
+
+
+def spatial_fields(model):
+    """
+    Snapshot of the arrays the metrics are computed on:
+    BE, C, necrosis, per-breed occupancy counts and intracellular bacteria
+    """
+    env = model.env
+    shape = env.BE.shape
+    fields = {"BE": env.BE, "C": env.C, "necrosis": env.necrosis, "BI": np.zeros(shape)}
+    for breed in (RestMP, InfectMP, ChronInfectMP, ActivatedMP, T):
+        agents = model.schedule.agents_by_breed[breed].values()
+        count = np.zeros(shape)
+        if agents:
+            x, y = np.array([agent.pos for agent in agents]).T
+            np.add.at(count, (x, y), 1)
+            if breed in (InfectMP, ChronInfectMP):
+                np.add.at(fields["BI"], (x, y), [agent.B_I for agent in agents])
+        fields[breed.__name__] = count
+    return fields
+
+
+def dilate(mask):
+    """
+    Grow a boolean mask by one cell in the Moore neighbourhood
+    """
+    padded = np.pad(mask, 1)
+    out = np.zeros_like(mask)
+    h, w = mask.shape
+    for dx in range(3):
+        for dy in range(3):
+            out |= padded[dx:dx + h, dy:dy + w]
+    return out
+
+
+def lesion(fields):
+    """
+    Cells with extracellular bacteria, infected macrophages or necrosis
+    """
+    return (
+        (fields["BE"] >= 1.0)
+        | (fields["InfectMP"] > 0)
+        | (fields["ChronInfectMP"] > 0)
+        | fields["necrosis"]
+    )
+
+
+def granuloma(fields):
+    """
+    Lesion cells plus the immune cells surrounding them
+    """
+    immune = (fields["RestMP"] + fields["ActivatedMP"] + fields["T"]) > 0
+    core = lesion(fields)
+    return core | (dilate(core) & immune)
+
+
+@register_metric("granuloma_size")
+def granuloma_size(fields):
+    return int(np.sum(granuloma(fields)))
+
+
+@register_metric("granuloma_compactness")
+def granuloma_compactness(fields):
+    """
+    Isoperimetric ratio 4 pi A / P^2 of the granuloma mask (P: exposed edges)
+    """
+    mask = granuloma(fields)
+    area = np.sum(mask)
+    if area == 0:
+        return np.nan
+    padded = np.pad(mask, 1).astype(int)
+    perimeter = np.sum(np.abs(np.diff(padded, axis = 0))) + np.sum(np.abs(np.diff(padded, axis = 1)))
+    return float(4 * np.pi * area / perimeter ** 2)
+
+
+def centroid(weights):
+    total = np.sum(weights)
+    if total <= 0:
+        return np.nan, np.nan
+    x = np.arange(weights.shape[0])
+    y = np.arange(weights.shape[1])
+    return float(x @ weights.sum(axis = 1) / total), float(y @ weights.sum(axis = 0) / total)
+
+
+@register_metric("T_ring_radius")
+def T_ring_radius(fields):
+    """
+    Mean distance of T cells from the centroid of infected macrophages
+    """
+    cx, cy = centroid(fields["InfectMP"] + fields["ChronInfectMP"])
+    if np.isnan(cx) or np.sum(fields["T"]) == 0:
+        return np.nan
+    x, y = np.nonzero(fields["T"])
+    w = fields["T"][x, y]
+    return float(np.sum(w * np.hypot(x - cx, y - cy)) / np.sum(w))
+
+
+@register_metric("bacteria_centroid_x")
+def bacteria_centroid_x(fields):
+    return centroid(fields["BE"] + fields["BI"])[0]
+
+
+@register_metric("bacteria_centroid_y")
+def bacteria_centroid_y(fields):
+    return centroid(fields["BE"] + fields["BI"])[1]
+
+
+@register_metric("necrotic_area")
+def necrotic_area(fields):
+    return int(np.sum(fields["necrosis"]))
+
+
+def collect_spatial(model, names):
+    """
+    Evaluate the named metrics and append them to the "Spatial" table
+    """
+    fields = spatial_fields(model)
+    row = {"tick": model.schedule.time}
+    for name in names:
+        row[name] = SPATIAL_METRICS[name](fields)
+    model.datacollector.add_table_row("Spatial", row)
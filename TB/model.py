@@ -2,13 +2,30 @@
 TB Model
 """
 
+import random
 
+import numpy as np
 from mesa import Model
 from mesa.space import MultiGrid
 from mesa.datacollection import DataCollector
 
 from TB.agents import Env, T, RestMP, InfectMP, ChronInfectMP, ActivatedMP, Source, Necrosis
 from TB.schedule import RandomActivationByBreed
+from TB.metrics import SPATIAL_METRICS, collect_spatial
+from TB.eventlog import EventLog, log_path
+
+class AntitheticRandom(random.Random):
+    """
+    Random stream returning 1 - u for every uniform draw u of the stream
+    seeded alike. Only draws built on random() are mirrored (random(),
+    choices(), TB.randint), not getrandbits-based ones such as
+    random.Random.randint; the scheduler shuffle is not mirrored either, so
+    replicates with and without it are only partly antithetic.
+    """
+
+    def random(self):
+        return 1.0 - super().random()
+
 
 class TB(Model):
 
@@ -114,6 +131,28 @@ class TB(Model):
         # Running time: 100 d
         t_total = round(100 * 24 * 600),
 
+        # Seed of every random stream used by the model (None: unseeded)
+        seed = None,
+
+        # Seeded runs draw from antithetic random streams
+        antithetic = False,
+
+        # Chemokine is solved on a grid downsampled by this factor (1, 2, 4)
+        coarsen = 1,
+
+        # Also solve chemokine at full resolution and report the error of C
+        check_chemokine = False,
+
+        # Spatial metrics are collected every metrics_every ticks (0: never)
+        metrics_every = 0,
+
+        # Names of the spatial metrics to collect (None: all registered)
+        metrics = None,
+
+        # Path of the binary log of cell state transitions (None: no log),
+        # {seed} is replaced by the seed
+        event_log = None,
+
     ):
         super().__init__()
         self.height = height
@@ -144,20 +183,40 @@ class TB(Model):
         self.c_I = c_I
         self.t_T = t_T
         self.t_total = t_total
+        self.metrics_every = metrics_every
+        self.metrics = list(SPATIAL_METRICS) if metrics is None else list(metrics)
+        unknown = set(self.metrics) - set(SPATIAL_METRICS)
+        if unknown:
+            raise ValueError("Unknown spatial metrics: %s" % sorted(unknown))
+        if antithetic and seed is None:
+            raise ValueError("antithetic = True requires a seed")
+        self.antithetic = antithetic
+        self.coarsen = coarsen
+        self.check_chemokine = check_chemokine
+        self.streams = None
+        self.event_log = event_log
+        # (x, y) size of the grid, as laid out by MultiGrid below
+        self.events = None if event_log is None else EventLog(log_path(event_log, seed = seed), (self.height, self.width))
+        if seed is not None:
+            self.reseed(seed)
 
         # Create Environment & basic settings
         self.env = Env(self.next_id(), self)
         self.schedule = RandomActivationByBreed(self)
         self.grid = MultiGrid(self.height, self.width, torus = False)
+        model_reporters = {
+            "RestMP": lambda m: m.schedule.get_breed_count(RestMP),
+            "InfectMP": lambda m: m.schedule.get_breed_count(InfectMP),
+            "ChonInfectMP": lambda m: m.schedule.get_breed_count(ChronInfectMP),
+            "ActivatedMP": lambda m: m.schedule.get_breed_count(ActivatedMP),
+            "T": lambda m: m.schedule.get_breed_count(T),
+            "Necrosis": lambda m: m.schedule.get_breed_count(Necrosis),
+        }
+        if self.check_chemokine:
+            model_reporters["ChemokineError"] = lambda m: m.env.C_error[-1] if m.env.C_error else 0.0
         self.datacollector = DataCollector(
-            {
-                "RestMP": lambda m: m.schedule.get_breed_count(RestMP),
-                "InfectMP": lambda m: m.schedule.get_breed_count(InfectMP),
-                "ChonInfectMP": lambda m: m.schedule.get_breed_count(ChronInfectMP),
-                "ActivatedMP": lambda m: m.schedule.get_breed_count(ActivatedMP),
-                "T": lambda m: m.schedule.get_breed_count(T),
-                "Necrosis": lambda m: m.schedule.get_breed_count(Necrosis),
-            }
+            model_reporters,
+            tables = {"Spatial": ["tick"] + self.metrics} if self.metrics_every else None,
         )
 
         # Create Extracellular Bacteria
@@ -183,13 +242,13 @@ class TB(Model):
             self.schedule.add(src)
                
         self.running = True
-        self.datacollector.collect(self)
+        self.collect()
     
     def step(self):
         self.schedule.step()
 
         # collect data for testing
-        self.datacollector.collect(self)
+        self.collect()
         if self.verbose:
             print(
                 [
@@ -203,10 +262,93 @@ class TB(Model):
                 ]
             )
     
-    def run_model(self):
+    def collect(self):
+        self.datacollector.collect(self)
+        if self.metrics_every and self.schedule.time % self.metrics_every == 0:
+            collect_spatial(self, self.metrics)
+
+    def log_event(self, event, pos, agent_id, B_I = 0.0):
+        """
+        Record a cell state transition of the current tick in the event log
+        """
+        if self.events is not None:
+            self.events.record(self.schedule.time + 1, event, pos, agent_id, B_I)
+
+    def reseed(self, seed):
+        """
+        Seed the model RNG together with the global `random` and `numpy`
+        generators, and switch the agents to one random stream per event
+        type derived from the seed.
+        """
+        self.reset_randomizer(seed)
+        random.seed(seed)
+        np.random.seed(seed % 2**32)
+        self.streams = {}
+
+    def stream(self, name):
+        """
+        Random stream of one event type (infection, recruit_MP, activation...)
+
+        Seeded models give every event type its own stream, so that runs with
+        the same seed but different parameters share the random numbers of
+        each event type (common random numbers). Unseeded models draw all
+        events from the global `random` module.
+        """
+        if self.streams is None:
+            return random
+        if name not in self.streams:
+            cls = AntitheticRandom if self.antithetic else random.Random
+            self.streams[name] = cls("%s:%s" % (self._seed, name))
+        return self.streams[name]
+
+    def randint(self, name, a, b):
+        """
+        Random integer in [a, b] from a single uniform draw of a stream, so
+        that antithetic streams mirror it as well
+        """
+        n = b - a + 1
+        return a + min(int(self.stream(name).random() * n), n - 1)
+
+    def bacterial_load(self):
+        """
+        Total bacteria: extracellular plus intracellular in infected macrophages
+        """
+        B_I = sum(
+            agent.B_I
+            for breed in (InfectMP, ChronInfectMP)
+            for agent in self.schedule.agents_by_breed[breed].values()
+        )
+        return float(np.sum(self.env.BE) + B_I)
+
+    def necrosis_area(self):
+        """
+        No. of necrotic grid cells
+        """
+        return int(np.sum(self.env.necrosis))
+
+    def total_ticks(self):
+        """
+        No. of ticks of a full run: t_total is in units of 6 s, a tick k of them
+        """
+        return round(self.t_total / self.k)
+
+    def run_model(self, steps = None):
 
-        for i in range(self.t_total):
+        for i in range(self.total_ticks() if steps is None else steps):
             self.step()
             if np.sum(self.env.BE) == 0.0 and self.schedule.get_breed_count(InfectMP)==0 and self.schedule.get_breed_count(ChronInfectMP)==0:
+                self.running = False
                 break
+        if not self.running or self.schedule.steps >= self.total_ticks():
+            self.close()
+        elif self.events is not None:
+            self.events.flush()
+
+    def close(self):
+        """
+        Write out and close the event log; call it when a run driven by
+        step() ends (run_model does when the run is over)
+        """
+        if self.events is not None:
+            self.events.close()
         
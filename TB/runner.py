@@ -0,0 +1,69 @@
+"""
+Batch runs of the TB model
+"""
+
+from multiprocessing import Pool
+
+from TB.eventlog import require_placeholder
+from TB.model import TB
+
+
+def run_replicate(params = None, seed = None, steps = None, model_cls = TB):
+    """
+    Run one seeded replicate and reduce it to its outcomes.
+
+    Args:
+        params: dict of model keyword arguments overriding the defaults
+        seed: seed of the replicate
+        steps: No. of ticks to run (None: the model's total_ticks())
+        model_cls: model class; an engine must take the TB keyword
+                   arguments (including seed) and provide verbose,
+                   run_model(steps), bacterial_load(), necrosis_area(),
+                   schedule.steps and datacollector (model_vars, tables)
+
+    Returns:
+        dict with the seed, params, No. of ticks run, final bacterial load,
+        necrosis area, the DataCollector breed series and spatial metrics
+    """
+    params = dict(params or {})
+    model = model_cls(seed = seed, **params)
+    model.verbose = False
+    model.run_model(steps)
+    model.close()
+    return outcomes(model, params, seed)
+
+
+def outcomes(model, params = None, seed = None):
+    """
+    Reduce a (finished) model to the outcomes compared across runs
+    """
+    return {
+        "seed": seed,
+        "params": dict(params or {}),
+        "steps": model.schedule.steps,
+        "bacterial_load": model.bacterial_load(),
+        "necrosis_area": model.necrosis_area(),
+        "series": {
+            name: list(values)
+            for name, values in model.datacollector.model_vars.items()
+        },
+        "spatial": {
+            name: list(values)
+            for name, values in model.datacollector.tables.get("Spatial", {}).items()
+        },
+    }
+
+
+def run_replicates(params = None, seeds = range(10), steps = None, model_cls = TB, processes = None):
+    """
+    Run run_replicate for every seed in a process pool. An event_log path
+    in params must hold {seed}, so that every seed gets its own log.
+
+    Returns:
+        list of outcome dicts, in the order of seeds
+    """
+    seeds = list(seeds)
+    require_placeholder((params or {}).get("event_log"), "seed", len(set(seeds)))
+    tasks = [(params, seed, steps, model_cls) for seed in seeds]
+    with Pool(processes) as pool:
+        return pool.starmap(run_replicate, tasks)
@@ -3,8 +3,99 @@ from mesa.visualization.modules import CanvasGrid, ChartModule
 from mesa.visualization.UserParam import UserSettableParameter
 
 from TB.agents import Env, T, RestMP, InfectMP, ChronInfectMP, ActivatedMP, Source, Necrosis
+from TB.background import BackgroundRunner
 from TB.model import TB
 
+
+class SampledModel:
+    """
+    Model as seen by the browser of a BackgroundServer: a frame request
+    (step) samples the model stepped by the background runner
+    """
+    def __init__(self, server, model):
+        self.server = server
+        self.model = model
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def step(self):
+        self.server.sample()
+
+
+class BackgroundServer(ModularServer):
+    """
+    Server whose model steps continuously on a background thread at full
+    speed; the browser shows the latest state at its own frame rate.
+
+    The server-only parameter run_ticks switches to batches of that many
+    ticks: a frame shows the model as it was when the batch in progress
+    started, and the first frame after the batch has reached its last tick
+    shows that tick and starts the next batch. The server never waits for
+    a batch, so it keeps answering the browser however long batches are.
+    Changes of the other user parameters are applied to the running model
+    between two ticks. When the browser stops requesting frames (Stop, or
+    the page closed) for idle_timeout seconds, the runner pauses; the next
+    frame request resumes it.
+    """
+
+    server_params = ("run_ticks",)
+
+    idle_timeout = 2.0
+
+    # Ticks of the next batch, started once the current frame is rendered
+    batch = 0
+    frame = None
+
+    def params(self):
+        params = {}
+        for key, val in self.model_kwargs.items():
+            if isinstance(val, UserSettableParameter):
+                if val.param_type == "static_text":
+                    continue
+                params[key] = val.value
+            else:
+                params[key] = val
+        return params
+
+    def reset_model(self):
+        if getattr(self, "runner", None) is not None:
+            self.runner.stop()
+        params = self.params()
+        model = self.model_cls(**{k: v for k, v in params.items() if k not in self.server_params})
+        self.runner = BackgroundRunner(model, self.idle_timeout)
+        self.model = SampledModel(self, model)
+        self.batch = 0
+        self.frame = None
+
+    def sample(self):
+        self.runner.touch()
+        params = self.params()
+        changed = {
+            k: v for k, v in params.items()
+            if k not in self.server_params and getattr(self.runner.model, k, v) != v
+        }
+        if changed:
+            self.runner.set_params(**changed)
+        self.batch = max(int(params.get("run_ticks", 0)), 0)
+        if self.batch > 0:
+            if self.runner.target is None:
+                # Switching from continuous stepping: stop where it is
+                self.runner.pause()
+        elif self.runner.target is not None or not self.runner.running.is_set():
+            self.runner.resume()
+
+    def render_model(self):
+        if self.batch > 0 and not self.runner.idle.is_set() and self.frame is not None:
+            # Batch still running: show the state it started from
+            return self.frame
+        with self.runner.lock:
+            self.frame = super().render_model()
+        if self.batch > 0:
+            self.runner.run_ticks(self.batch)
+        return self.frame
+
+
 def TB_portrayal(agent):
     if agent is None:
         return
@@ -73,3 +164,22 @@ canvas_element = CanvasGrid(TB_portrayal, 100, 100, 500, 500)
 server = ModularServer(
     TB, [canvas_element], "TB")
 server.port = 8521
+
+
+def make_background_server():
+    """
+    Build the server stepping the model on a background thread. Built on
+    demand only: creating it already creates a model and starts its runner.
+    """
+    background_server = BackgroundServer(
+        TB, [canvas_element], "TB",
+        {
+            "run_ticks": UserSettableParameter("number", "Ticks per frame (0: continuous)", 0),
+            "T_recr": UserSettableParameter("slider", "Prob. of T recruitment", 32.5 * 0.01, 0.1, 0.4, 0.005),
+            "T_move": UserSettableParameter("slider", "Prob. of T movement", 0.825 * 0.01, 0.005, 0.02, 0.00025),
+            "T_actm": UserSettableParameter("slider", "Prob. of a T to activate a MP", 3 * 0.01, 0.03, 0.1, 0.005),
+            "M_recr": UserSettableParameter("slider", "Prob. of MP recruitment", 2.75 * 0.01, 0.02, 0.05, 0.0025),
+        },
+    )
+    background_server.port = 8521
+    return background_server
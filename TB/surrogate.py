@@ -0,0 +1,193 @@
+"""
+Surrogate emulator of TB run outcomes
+
+Gaussian-process regressors are trained on completed run results (the
+outcome dicts of TB.runner, e.g. merged from TB.workqueue) and predict
+outcomes with their uncertainty anywhere in the parameter space in
+milliseconds. propose picks the parameter points where the emulator is
+least certain, to be simulated next (active learning).
+
+    em = Emulator(["alpha_BI", "T_recr", "T_actm", "M_recr", "p_k"])
+    em.fit(merge("/shared/sweep"))
+    mean, std = em.predict([{"alpha_BI": 3e-5, ...}])["log_bacterial_load"]
+    next_points = em.propose(8)
+"""
+
+import copy
+import inspect
+
+import numpy as np
+
+from TB.model import TB
+
+# Outcome emulated from a run result
+OUTPUTS = {
+    "log_bacterial_load": lambda result, em: np.log1p(result["bacterial_load"]),
+    "contained": lambda result, em: float(result["bacterial_load"] <= em.containment_load),
+    "necrosis_area": lambda result, em: result["necrosis_area"],
+}
+
+DEFAULTS = {
+    name: p.default
+    for name, p in inspect.signature(TB.__init__).parameters.items()
+    if p.default is not inspect.Parameter.empty
+}
+
+
+class GaussianProcess:
+    """
+    Gaussian-process regressor with a squared-exponential kernel on inputs
+    scaled to [0, 1]. Length scale and noise are chosen by maximizing the
+    log marginal likelihood over a grid.
+    """
+
+    length_scales = (0.1, 0.2, 0.4, 0.8, 1.6)
+    noises = (1e-4, 1e-2, 1e-1, 0.3, 1.0)
+
+    def kernel(self, A, B):
+        d2 = np.sum((A[:, None, :] - B[None, :, :]) ** 2, axis = -1)
+        return np.exp(-0.5 * d2 / self.length_scale ** 2)
+
+    def fit(self, X, y):
+        self.X = np.asarray(X, dtype = float)
+        y = np.asarray(y, dtype = float)
+        self.y_mean = np.mean(y)
+        self.y_std = np.std(y) or 1.0
+        z = (y - self.y_mean) / self.y_std
+
+        best = -np.inf
+        for length_scale in self.length_scales:
+            self.length_scale = length_scale
+            K0 = self.kernel(self.X, self.X)
+            for noise in self.noises:
+                try:
+                    L = np.linalg.cholesky(K0 + noise * np.eye(len(z)))
+                except np.linalg.LinAlgError:
+                    continue
+                alpha = np.linalg.solve(L.T, np.linalg.solve(L, z))
+                loglik = -0.5 * z @ alpha - np.sum(np.log(np.diag(L)))
+                if loglik > best:
+                    best = loglik
+                    params = (length_scale, noise, L, alpha)
+        self.length_scale, self.noise, self.L, self.alpha = params
+        self.z = z
+        self.noise_diag = np.full(len(z), self.noise)
+        return self
+
+    def condition(self, X, noise = 1e-6):
+        """
+        Copy of the GP with observations added at X, at their predicted mean
+        and with (near-)zero noise; length scale, noise and scaling are kept
+        """
+        X = np.asarray(X, dtype = float)
+        mean, _ = self.predict(X)
+        gp = copy.copy(self)
+        gp.X = np.vstack([self.X, X])
+        gp.z = np.append(self.z, (mean - self.y_mean) / self.y_std)
+        gp.noise_diag = np.append(self.noise_diag, np.full(len(X), noise))
+        gp.L = np.linalg.cholesky(gp.kernel(gp.X, gp.X) + np.diag(gp.noise_diag))
+        gp.alpha = np.linalg.solve(gp.L.T, np.linalg.solve(gp.L, gp.z))
+        return gp
+
+    def predict(self, X):
+        """
+        Returns:
+            tuple of (mean, std) of the latent function at X
+        """
+        Ks = self.kernel(np.asarray(X, dtype = float), self.X)
+        mean = Ks @ self.alpha
+        v = np.linalg.solve(self.L, Ks.T)
+        var = np.clip(1.0 - np.sum(v ** 2, axis = 0), 0.0, None)
+        return self.y_mean + self.y_std * mean, self.y_std * np.sqrt(var)
+
+
+class Emulator:
+    """
+    One Gaussian process per outcome over the chosen model parameters
+    """
+
+    def __init__(self, params, bounds = None, outputs = tuple(OUTPUTS), containment_load = DEFAULTS["BE_init"], seed = None):
+        """
+        params: names of the model parameters spanning the input space
+        bounds: dict of name -> (low, high); the others are the range of
+                the training data, recomputed on every fit
+        outputs: names of the emulated outcomes (see OUTPUTS)
+        containment_load: a run is contained when its final bacterial load
+                          does not exceed this (default: the inoculum)
+        """
+        self.params = list(params)
+        self.fixed_bounds = dict(bounds or {})
+        self.bounds = dict(self.fixed_bounds)
+        self.outputs = list(outputs)
+        self.containment_load = containment_load
+        self.rng = np.random.default_rng(seed)
+        self.models = {}
+
+    def inputs(self, points):
+        """
+        Scale parameter dicts to [0, 1]^d; missing params take the TB default
+        """
+        X = np.array([[point.get(name, DEFAULTS[name]) for name in self.params] for point in points], dtype = float)
+        low = np.array([self.bounds[name][0] for name in self.params], dtype = float)
+        high = np.array([self.bounds[name][1] for name in self.params], dtype = float)
+        return (X - low) / np.where(high > low, high - low, 1.0)
+
+    def fit(self, results):
+        self.results = list(results)
+        points = [result["params"] for result in self.results]
+        self.bounds = dict(self.fixed_bounds)
+        for name in self.params:
+            if name not in self.bounds:
+                values = [point.get(name, DEFAULTS[name]) for point in points]
+                self.bounds[name] = (min(values), max(values))
+        X = self.inputs(points)
+        for output in self.outputs:
+            self.models[output] = GaussianProcess().fit(X, self.targets(output))
+        return self
+
+    def predict(self, points):
+        """
+        Returns:
+            dict of output name -> (mean, std) arrays over the points;
+            "contained" is clipped to a probability
+        """
+        X = self.inputs(points)
+        out = {}
+        for output, gp in self.models.items():
+            mean, std = gp.predict(X)
+            if output == "contained":
+                mean = np.clip(mean, 0.0, 1.0)
+            out[output] = (mean, std)
+        return out
+
+    def sample_points(self, n):
+        """
+        n points drawn uniformly within the bounds
+        """
+        low = np.array([self.bounds[name][0] for name in self.params], dtype = float)
+        high = np.array([self.bounds[name][1] for name in self.params], dtype = float)
+        X = low + (high - low) * self.rng.random((n, len(self.params)))
+        return [dict(zip(self.params, x.tolist())) for x in X]
+
+    def propose(self, n = 1, output = "log_bacterial_load", candidates = 2000):
+        """
+        Propose the n parameter points to simulate next: the candidates of
+        largest predictive std of `output`, chosen one at a time with the
+        pending points added noise-free at their predicted mean (kriging
+        believer), so that the next ones are sought elsewhere.
+        """
+        pool = self.sample_points(candidates)
+        X_pool = self.inputs(pool)
+        gp = self.models[output]
+
+        chosen = []
+        believer = gp
+        for i in range(n):
+            _, std = believer.predict(X_pool)
+            std[chosen] = -np.inf
+            chosen.append(int(np.argmax(std)))
+            believer = gp.condition(X_pool[chosen])
+        return [pool[i] for i in chosen]
+
+    def targets(self, output):
+        return np.array([OUTPUTS[output](result, self) for result in self.results], dtype = float)
@@ -0,0 +1,127 @@
+"""
+Variance-reduced replicates: common random numbers and antithetic pairs
+
+Seeded TB models draw every event type (infection, recruitment, T
+activation, cell movement, ages...) from its own random stream derived
+from the seed. Running two parameter settings with the same seeds
+therefore synchronizes their random numbers event type by event type
+(common random numbers), and a seed run with antithetic = True mirrors
+the uniform draws of those streams.
+
+The scheduler shuffle (the model RNG) is merely seeded alike, and once
+two runs diverge the draws of a stream go to different cells, so pairs
+are only partly correlated and antithetic pairs only partly
+anti-correlated. The estimators report the correlation achieved within
+the pairs along with the variance and the effective sample size (the No.
+of independent replicates giving the same variance), showing whether the
+pairing helped.
+"""
+
+import numpy as np
+
+from TB.model import TB
+from TB.runner import run_replicates
+
+
+def correlation(a, b):
+    """
+    Pearson correlation of paired outcomes (nan if either is constant)
+    """
+    if np.std(a) == 0 or np.std(b) == 0:
+        return np.nan
+    return float(np.corrcoef(a, b)[0, 1])
+
+
+def outcome_values(runs, outcome = "bacterial_load"):
+    """
+    Args:
+        outcome: key of the run outcome dicts, or a function of one of them
+    """
+    if callable(outcome):
+        return np.array([outcome(run) for run in runs], dtype = float)
+    return np.array([run[outcome] for run in runs], dtype = float)
+
+
+def paired_runs(params_a, params_b, seeds = range(10), steps = None, model_cls = TB, processes = None):
+    """
+    Run two parameter settings with common random numbers (same seeds)
+
+    Returns:
+        tuple of the two lists of outcome dicts, paired by seed
+    """
+    seeds = list(seeds)
+    log_a = (params_a or {}).get("event_log")
+    if log_a is not None and log_a == (params_b or {}).get("event_log"):
+        raise ValueError("The two settings need different event_log paths")
+    runs_a = run_replicates(params_a, seeds, steps, model_cls, processes)
+    runs_b = run_replicates(params_b, seeds, steps, model_cls, processes)
+    return runs_a, runs_b
+
+
+def antithetic_runs(params = None, seeds = range(10), steps = None, model_cls = TB, processes = None):
+    """
+    Run every seed plainly and with antithetic streams
+
+    Returns:
+        tuple of the two lists of outcome dicts, paired by seed
+    """
+    params = dict(params or {})
+    params_anti = dict(params, antithetic = True)
+    if params.get("event_log") is not None:
+        params_anti["event_log"] = params["event_log"] + ".antithetic"
+    return paired_runs(
+        dict(params, antithetic = False), params_anti,
+        seeds, steps, model_cls, processes,
+    )
+
+
+def paired_difference(runs_a, runs_b, outcome = "bacterial_load"):
+    """
+    Estimate E[a] - E[b] from CRN-paired runs
+
+    Returns:
+        dict with the estimate, its variance and standard error, the
+        correlation of a and b over the pairs (positive helps), and the
+        effective sample size: No. of independent runs per setting that
+        would give the same variance
+    """
+    a = outcome_values(runs_a, outcome)
+    b = outcome_values(runs_b, outcome)
+    n = len(a)
+    d = a - b
+    var = np.var(d, ddof = 1) / n
+    var_independent = (np.var(a, ddof = 1) + np.var(b, ddof = 1)) / n
+    return {
+        "estimate": float(np.mean(d)),
+        "variance": float(var),
+        "stderr": float(np.sqrt(var)),
+        "n": n,
+        "correlation": correlation(a, b),
+        "ess": float(n * var_independent / var) if var > 0 else np.inf,
+    }
+
+
+def antithetic_mean(runs, runs_anti, outcome = "bacterial_load"):
+    """
+    Estimate E[y] from antithetic pairs
+
+    Returns:
+        dict with the estimate, its variance and standard error, the
+        correlation within the antithetic pairs (negative helps), and the
+        effective sample size: No. of independent runs that would give the
+        same variance (to be compared with the 2n runs used)
+    """
+    y = outcome_values(runs, outcome)
+    y_anti = outcome_values(runs_anti, outcome)
+    n = len(y)
+    m = (y + y_anti) / 2
+    var = np.var(m, ddof = 1) / n
+    var_run = np.var(np.concatenate([y, y_anti]), ddof = 1)
+    return {
+        "estimate": float(np.mean(m)),
+        "variance": float(var),
+        "stderr": float(np.sqrt(var)),
+        "n": 2 * n,
+        "correlation": correlation(y, y_anti),
+        "ess": float(var_run / var) if var > 0 else np.inf,
+    }
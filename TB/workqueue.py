@@ -0,0 +1,304 @@
+"""
+Work queue on a shared directory for running sweeps on several hosts
+
+A sweep spec is split into one JSON task file per run in pending/. Workers
+on any host sharing the directory claim a task by renaming it into
+claimed/ (atomic on POSIX filesystems), keep touching it as a heartbeat
+while the run is going, write the outcome to results/ and move the task
+to done/. Claims whose heartbeat is older than the stale timeout are put
+back into pending/. A task whose run raises is moved to done/ with a
+failure record holding the traceback in failed/. merge combines the
+per-task results.
+
+    $ python -m TB.workqueue submit /shared/sweep spec.json
+    $ python -m TB.workqueue worker /shared/sweep      # on every node
+    $ python -m TB.workqueue merge /shared/sweep results.json
+
+Sweep spec:
+    {
+        "name": "alpha",                      # prefix of the task ids
+        "base": {"T_recr": 0.3},              # fixed model params
+        "params": {"alpha_BI": [2e-5, 3e-5]}, # swept params (cartesian)
+        "seeds": [0, 1, 2],                   # or "replicates": 3
+        "steps": 1440                         # ticks per run (default: a full run)
+    }
+
+An event_log path in the params must hold {id}, replaced by the task id,
+so that every task writes its own log.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+
+from TB.eventlog import log_path, require_placeholder
+from TB.runner import run_replicate
+
+STATES = ("pending", "claimed", "done", "results", "failed")
+
+
+def queue_path(queue_dir, state, task_id = None):
+    path = os.path.join(queue_dir, state)
+    return path if task_id is None else os.path.join(path, task_id + ".json")
+
+
+def write_json(path, obj):
+    """
+    Write a JSON file atomically (temporary file + rename)
+    """
+    tmp = "%s.%s.%d.tmp" % (path, socket.gethostname(), os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def task_ids(queue_dir, state):
+    return sorted(
+        name[:-len(".json")]
+        for name in os.listdir(queue_path(queue_dir, state))
+        if name.endswith(".json")
+    )
+
+
+def split_sweep(spec):
+    """
+    Expand a sweep spec into the list of run tasks
+    """
+    names = sorted(spec.get("params", {}))
+    seeds = spec.get("seeds", range(spec.get("replicates", 1)))
+    tasks = []
+    grid = itertools.product(*(spec["params"][name] for name in names))
+    for values, seed in itertools.product(list(grid), seeds):
+        params = dict(spec.get("base", {}))
+        params.update(zip(names, values))
+        task_id = "%s-%06d" % (spec.get("name", "sweep"), len(tasks))
+        require_placeholder(params.get("event_log"), "id", 2)
+        if params.get("event_log") is not None:
+            params["event_log"] = log_path(params["event_log"], id = task_id)
+        tasks.append({
+            "id": task_id,
+            "params": params,
+            "seed": seed,
+            "steps": spec.get("steps"),
+        })
+    return tasks
+
+
+def submit(queue_dir, spec):
+    """
+    Create the queue directories and add the tasks of a sweep spec
+
+    Returns:
+        list of the submitted task ids
+    """
+    for state in STATES:
+        os.makedirs(queue_path(queue_dir, state), exist_ok = True)
+    tasks = split_sweep(spec)
+    for task in tasks:
+        write_json(queue_path(queue_dir, "pending", task["id"]), task)
+    return [task["id"] for task in tasks]
+
+
+def claim(queue_dir):
+    """
+    Atomically claim one pending task
+
+    Returns:
+        the task dict, or None if nothing is pending
+    """
+    for task_id in task_ids(queue_dir, "pending"):
+        pending = queue_path(queue_dir, "pending", task_id)
+        claimed = queue_path(queue_dir, "claimed", task_id)
+        try:
+            # Touch before the rename: the claim must not inherit the
+            # submit-time mtime, or it would look stale right away
+            os.utime(pending)
+            os.rename(pending, claimed)
+            os.utime(claimed)
+            return read_json(claimed)
+        except FileNotFoundError:
+            # Claimed by another worker, or requeued, in the meantime
+            continue
+    return None
+
+
+def requeue_stale(queue_dir, stale = 300):
+    """
+    Put claimed tasks without a heartbeat for `stale` seconds back in pending/
+
+    Returns:
+        list of the requeued task ids
+    """
+    requeued = []
+    now = time.time()
+    for task_id in task_ids(queue_dir, "claimed"):
+        claimed = queue_path(queue_dir, "claimed", task_id)
+        try:
+            if now - os.path.getmtime(claimed) < stale:
+                continue
+            os.rename(claimed, queue_path(queue_dir, "pending", task_id))
+        except FileNotFoundError:
+            continue
+        requeued.append(task_id)
+    return requeued
+
+
+class Heartbeat(threading.Thread):
+    """
+    Touch a claimed task file every `interval` seconds until stopped
+    """
+    def __init__(self, path, interval):
+        super().__init__(daemon = True)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                # Requeued as stale; the result is still written when done
+                pass
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_task(queue_dir, task, heartbeat = 30):
+    """
+    Run a claimed task. A task whose run raises leaves a failure record
+    with the traceback in failed/ instead of a result, so that it is not
+    requeued to crash the other workers in turn.
+
+    Returns:
+        True if the run succeeded
+    """
+    claimed = queue_path(queue_dir, "claimed", task["id"])
+    beat = Heartbeat(claimed, heartbeat)
+    beat.start()
+    try:
+        result = run_replicate(task["params"], task["seed"], task["steps"])
+    except Exception:
+        result = None
+        error = traceback.format_exc()
+    finally:
+        beat.stop()
+    if result is None:
+        failure = dict(task, host = socket.gethostname(), error = error)
+        write_json(queue_path(queue_dir, "failed", task["id"]), failure)
+        finish(queue_dir, task["id"])
+        return False
+    result["id"] = task["id"]
+    result["host"] = socket.gethostname()
+    write_json(queue_path(queue_dir, "results", task["id"]), result)
+    finish(queue_dir, task["id"])
+    return True
+
+
+def finish(queue_dir, task_id):
+    """
+    Move a claimed task to done/
+    """
+    claimed = queue_path(queue_dir, "claimed", task_id)
+    try:
+        os.rename(claimed, queue_path(queue_dir, "done", task_id))
+    except FileNotFoundError:
+        # Requeued while running: drop the duplicate pending copy
+        try:
+            os.rename(queue_path(queue_dir, "pending", task_id), queue_path(queue_dir, "done", task_id))
+        except FileNotFoundError:
+            pass
+
+
+def work(queue_dir, heartbeat = 30, stale = 300, poll = 5, max_tasks = None):
+    """
+    Claim and run tasks until the queue is drained.
+
+    Args:
+        heartbeat: seconds between heartbeats of the running task
+        stale: seconds without heartbeat after which a claim is requeued
+        poll: seconds to wait while other workers still hold claims
+        max_tasks: stop after this many tasks (None: no limit)
+
+    Returns:
+        No. of tasks run by this worker
+    """
+    done = 0
+    while max_tasks is None or done < max_tasks:
+        requeue_stale(queue_dir, stale)
+        task = claim(queue_dir)
+        if task is None:
+            if not task_ids(queue_dir, "claimed"):
+                break
+            time.sleep(poll)
+            continue
+        run_task(queue_dir, task, heartbeat)
+        done += 1
+    return done
+
+
+def status(queue_dir):
+    return {state: len(task_ids(queue_dir, state)) for state in STATES}
+
+
+def merge(queue_dir, out = None):
+    """
+    Combine the per-task results, ordered by task id
+
+    Args:
+        out: optional path of a JSON file the merged list is written to
+    """
+    results = [
+        read_json(queue_path(queue_dir, "results", task_id))
+        for task_id in task_ids(queue_dir, "results")
+    ]
+    if out is not None:
+        write_json(out, results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest = "command", required = True)
+    p = commands.add_parser("submit")
+    p.add_argument("queue_dir")
+    p.add_argument("spec")
+    p = commands.add_parser("worker")
+    p.add_argument("queue_dir")
+    p.add_argument("--heartbeat", type = float, default = 30)
+    p.add_argument("--stale", type = float, default = 300)
+    p.add_argument("--poll", type = float, default = 5)
+    p.add_argument("--max-tasks", type = int, default = None)
+    p = commands.add_parser("requeue")
+    p.add_argument("queue_dir")
+    p.add_argument("--stale", type = float, default = 300)
+    p = commands.add_parser("status")
+    p.add_argument("queue_dir")
+    p = commands.add_parser("merge")
+    p.add_argument("queue_dir")
+    p.add_argument("out")
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        print("%d tasks submitted" % len(submit(args.queue_dir, read_json(args.spec))))
+    elif args.command == "worker":
+        n = work(args.queue_dir, args.heartbeat, args.stale, args.poll, args.max_tasks)
+        print("%d tasks run" % n)
+    elif args.command == "requeue":
+        print("%d tasks requeued" % len(requeue_stale(args.queue_dir, args.stale)))
+    elif args.command == "status":
+        print(status(args.queue_dir))
+    else:
+        print("%d results merged" % len(merge(args.queue_dir, args.out)))
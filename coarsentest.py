@@ -0,0 +1,32 @@
+"""
+Check of the coarse chemokine grid: chemokine deposited anywhere, edges
+included, keeps about the same mass after a tick whatever coarsen is
+"""
+
+from TB.model import TB
+
+
+def mass_after_tick(coarsen, positions, amount = 5000):
+    model = TB(coarsen = coarsen)
+    for pos in positions:
+        model.env.secrete(pos, amount)
+    model.env.step()
+    return model.env.C.sum()
+
+
+if __name__ == "__main__":
+    checks = {
+        # Away from the edges restriction and diffusion conserve the mass
+        "interior": ([(50, 50), (30, 61)], 1e-3),
+        # Near the edges some leaves through the zero boundary, as at full
+        # resolution, but nothing is wiped by the coarse border cells
+        "edges": ([(x, 50) for x in range(1, 21)] + [(50, y) for y in range(80, 99)], 0.1),
+    }
+    for name, (positions, tolerance) in checks.items():
+        full = mass_after_tick(1, positions)
+        for coarsen in (2, 4):
+            coarse = mass_after_tick(coarsen, positions)
+            error = abs(coarse - full) / full
+            print("%-8s coarsen = %d: %10.1f vs %10.1f (%.2f%%)" % (name, coarsen, coarse, full, 100 * error))
+            assert error <= tolerance, name
+    print("OK")
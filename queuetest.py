@@ -0,0 +1,54 @@
+"""
+Local check of TB.workqueue: several worker processes on one directory,
+tasks that waited long in pending/, a crashed worker's stale claim and a
+task whose run fails
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from TB import workqueue
+
+
+if __name__ == "__main__":
+    queue_dir = tempfile.mkdtemp()
+    ids = workqueue.submit(queue_dir, {"params": {"p_k": [0.02, 0.05]}, "replicates": 4, "steps": 3})
+    # A task the model rejects must not take the workers down
+    bad = workqueue.submit(queue_dir, {"name": "bad", "base": {"bogus": 1}, "steps": 3})
+
+    # Tasks submitted an hour ago must not look stale once claimed, even if
+    # another worker requeues stale claims right in the middle of the claim
+    for task_id in bad + ids:
+        os.utime(workqueue.queue_path(queue_dir, "pending", task_id), (time.time() - 3600,) * 2)
+    utime = os.utime
+    def racing_utime(path, *args):
+        workqueue.requeue_stale(queue_dir, stale = 1)
+        utime(path, *args)
+    os.utime = racing_utime
+    task = workqueue.claim(queue_dir)
+    os.utime = utime
+    assert task is not None and workqueue.status(queue_dir)["claimed"] == 1
+
+    # The claim above belongs to a worker that crashed: no more heartbeats
+    utime(workqueue.queue_path(queue_dir, "claimed", task["id"]), (time.time() - 3600,) * 2)
+
+    workers = [
+        subprocess.Popen([
+            sys.executable, "-m", "TB.workqueue", "worker", queue_dir,
+            "--heartbeat", "0.5", "--stale", "2", "--poll", "0.2",
+        ])
+        for i in range(3)
+    ]
+    for worker in workers:
+        assert worker.wait() == 0
+
+    status = workqueue.status(queue_dir)
+    print(status)
+    assert status == {"pending": 0, "claimed": 0, "done": len(bad + ids), "results": len(ids), "failed": len(bad)}
+    assert [result["id"] for result in workqueue.merge(queue_dir)] == ids
+    failure = workqueue.read_json(workqueue.queue_path(queue_dir, "failed", bad[0]))
+    assert "TypeError" in failure["error"]
+    print("OK")
@@ -1,3 +1,8 @@
-from TB.server import server
+import sys
 
-server.launch()
+from TB.server import server, make_background_server
+
+if "--background" in sys.argv:
+    make_background_server().launch()
+else:
+    server.launch()